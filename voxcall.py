@@ -2,20 +2,28 @@ import time
 import datetime
 import subprocess
 import pyaudio
-import wave
 import sys
 import os
 import errno
-from numpy import short, array, chararray, frombuffer, log10
-import traceback
+from numpy import short, frombuffer, int32, arange, maximum, trunc, log10
+import math
 from tkinter import *
 from tkinter import ttk
-from configparser import ConfigParser
-import _thread
-import urllib3
+from configparser import ConfigParser, Error as ConfigError
+import threading
+import queue
+import concurrent.futures
 from shutil import copyfile
 import logging
+import logging.handlers
+import atexit
+import functools
 import json
+try:
+    # optional, compiles the peak scan to a native loop when numba is installed
+    from numba import njit
+except ImportError:
+    njit = None
 
 # logging.basicConfig(filename='log.txt',filemode='w',level=logger.debug)
 
@@ -37,9 +45,12 @@ formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 ch.setFormatter(formatter)
 fh.setFormatter(formatter)
 
-# add ch and fh to logger
-logger.addHandler(ch)
-logger.addHandler(fh)
+# ch and fh run on a background listener, the audio and upload threads only enqueue records
+log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+log_listener = logging.handlers.QueueListener(log_queue, ch, fh, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 
 # record_threshold = 800
 vox_silence_time = 2
@@ -48,6 +59,7 @@ start_minimized = 0
 rectime = .1
 rec_debounce_counter = 0
 timeout_time_sec = 120
+upload_wait_time_sec = 60
 '''
 class Logger(object):
 	def __init__(self):
@@ -75,94 +87,80 @@ if getattr(sys, 'frozen', False):
     version = os.path.basename(sys.executable).split('.')[0]
 elif __file__:
     version = os.path.basename(__file__).split('.')[0]
+# the Broadcastify endpoint only depends on the executable name, work it out once
+if version.endswith('DEV'):
+    BCFY_URL = 'https://api.broadcastify.com/call-upload-dev'
+else:
+    BCFY_URL = 'https://api.broadcastify.com/call-upload'
 
 config = ConfigParser()
 config.read('config.cfg')
 
-try:
-    audio_dev_index = config.getint('Section1', 'audio_dev_index')
-except:
-    audio_dev_index = 0
-try:
-    record_threshold_config = config.getint('Section1', 'record_threshold')
-except:
-    record_threshold_config = 75
-try:
-    vox_silence_time = config.getfloat('Section1', 'vox_silence_time')
-except:
-    vox_silence_time = 3
-try:
-    in_channel_config = config.get('Section1', 'in_channel')
-except:
-    in_channel_config = 'mono'
-try:
-    BCFY_SystemId_config = config.get('Section1', 'BCFY_SystemId')
-except:
-    BCFY_SystemId_config = ''
-try:
-    BCFY_SlotId_config = config.get('Section1', 'BCFY_SlotId')
-except:
-    BCFY_SlotId_config = '1'
-try:
-    RadioFreq_config = config.get('Section1', 'RadioFreq')
-except:
-    RadioFreq_config = ''
-try:
-    BCFY_APIkey_config = config.get('Section1', 'BCFY_APIkey')
-except:
-    BCFY_APIkey_config = ''
-try:
-    saveaudio_config = config.getint('Section1', 'saveaudio')
-except:
-    saveaudio_config = 0
+
+def read_section(section):
+    try:
+        return dict(config.items(section))
+    except ConfigError:
+        # a value that doesn't interpolate (a lone '%') only drops that one setting back to its default
+        items = {}
+        for key in config.options(section):
+            try:
+                items[key] = config.get(section, key)
+            except ConfigError:
+                logger.warning("Ignoring unreadable config value for %s", key)
+        return items
+
+
+# read the section once, the settings below are plain dict lookups (ConfigParser lowercases option names)
+config_items = read_section('Section1') if config.has_section('Section1') else {}
+
+
+def config_value(key, default, conv=str):
+    try:
+        return conv(config_items[key.lower()])
+    except (KeyError, ValueError):
+        return default
+
+
+audio_dev_index = config_value('audio_dev_index', 0, int)
+record_threshold_config = config_value('record_threshold', 75, int)
+in_channel_config = config_value('in_channel', 'mono')
+BCFY_SystemId_config = config_value('BCFY_SystemId', '')
+BCFY_SlotId_config = config_value('BCFY_SlotId', '1')
+RadioFreq_config = config_value('RadioFreq', '')
+BCFY_APIkey_config = config_value('BCFY_APIkey', '')
+saveaudio_config = config_value('saveaudio', 0, int)
 try:
     vox_silence_time = config.getfloat('Section', 'vox_silence_time')
 except:
     vox_silence_time = 2
-try:
-    RDIO_APIkey_config = config.get('Section1', 'RDIO_APIkey')
-except:
-    RDIO_APIkey_config = ''
-try:
-    RDIO_APIurl_config = config.get('Section1', 'RDIO_APIurl')
-except:
-    RDIO_APIurl_config = ''
-try:
-    RDIO_system_config = config.get('Section1', 'RDIO_system')
-except:
-    RDIO_system_config = ''
-try:
-    RDIO_tg_config = config.get('Section1', 'RDIO_tg')
-except:
-    RDIO_tg_config = ''
-try:
-    OpenMHz_APIkey_config = config.get('Section1', 'openmhz_api_key')
-except:
-    OpenMHz_APIkey_config = ''
-try:
-    OpenMHz_ShortName_config = config.get('Section1', 'openmhz_short_name')
-except:
-    OpenMHz_ShortName_config = ''
-try:
-    OpenMHz_tgid_config = config.get('Section1', 'openmhz_tgid')
-except:
-    OpenMHz_tgid_config = ''
-try:
-    icad_URL_config = config.get('Section1', 'icad_url')
-except:
-    icad_URL_config = ''
-try:
-    icad_APIkey_config = config.get('Section1', 'icad_api_key')
-except:
-    icad_APIkey_config = ''
-try:
-    icad_short_name_config = config.get('Section1', 'icad_short_name')
-except:
-    icad_short_name_config = ''
-try:
-    icad_tgid_config = config.get('Section1', 'icad_tgid')
-except:
-    icad_tgid_config = ''
+RDIO_APIkey_config = config_value('RDIO_APIkey', '')
+RDIO_APIurl_config = config_value('RDIO_APIurl', '')
+RDIO_system_config = config_value('RDIO_system', '')
+RDIO_tg_config = config_value('RDIO_tg', '')
+OpenMHz_APIkey_config = config_value('openmhz_api_key', '')
+OpenMHz_ShortName_config = config_value('openmhz_short_name', '')
+OpenMHz_tgid_config = config_value('openmhz_tgid', '')
+icad_URL_config = config_value('icad_url', '')
+icad_APIkey_config = config_value('icad_api_key', '')
+icad_short_name_config = config_value('icad_short_name', '')
+icad_tgid_config = config_value('icad_tgid', '')
+# fraction of the squelch threshold the audio has to drop below before a recording counts it as
+# silence, values below 1 add hysteresis so noise hovering around the threshold doesn't chop recordings
+squelch_release_ratio = config_value('squelch_release_ratio', 1.0, float)
+# keep the VOX loop on its own core, away from ffmpeg and the upload threads (Linux only)
+pin_cpu = config_value('pin_cpu', 0, int)
+# seconds to wait on the heartbeat and upload APIs before giving up on a request
+http_timeout = config_value('http_timeout', 30, float)
+# seconds between Broadcastify heartbeats, a shorter interval also keeps a pooled connection to the
+# API warm for quiet channels
+heartbeat_interval_sec = config_value('heartbeat_interval', 10 * 60, float)
+# anything shorter would re-arm the timer back to back and flood the API
+heartbeat_interval_min_sec = 60
+if heartbeat_interval_sec < heartbeat_interval_min_sec:
+    logger.warning("heartbeat_interval %s is too short, using %s sec", heartbeat_interval_sec,
+                   heartbeat_interval_min_sec)
+    heartbeat_interval_sec = heartbeat_interval_min_sec
 
 try:
     root = Tk()
@@ -171,32 +169,46 @@ try:
     root.title('voxcall')
 except:
     root = ''
-try:
-    root.iconbitmap('voxcall.ico')
-except:
-    pass
 
-try:
-    p = pyaudio.PyAudio()
-    # list of the names of the audio input and output devices
-    input_devices = []
-    input_device_indices = {}
-
-    # FIND THE AUDIO DEVICES ON THE SYSTEM
-    info = p.get_host_api_info_by_index(0)
-    numdevices = info.get('deviceCount')
-
-    # find index of pyaudio input and output devices
-    for i in range(0, numdevices):
-        if p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels') > 0:
-            input_devices.append(p.get_device_info_by_host_api_device_index(0, i).get('name'))
-            input_device_indices[p.get_device_info_by_host_api_device_index(0, i).get('name')] = i
-            inv_input_device_indices = dict((v, k) for k, v in input_device_indices.items())
-    p.terminate()
-except:
-    # exc_type, exc_value, exc_traceback = sys.exc_info()
-    # traceback.print_exception(exc_type, exc_value, exc_traceback,limit=2,file=sys.stdout)
-    logging.exception('Got exception on main handler')
+
+def apply_window_icon():
+    try:
+        root.iconbitmap('voxcall.ico')
+    except TclError:
+        pass
+
+
+# .ico files only work as a window icon on Windows, other window systems just raise; loading it waits
+# until the mainloop has drawn the window so it stays off the startup path
+if root != '' and sys.platform == 'win32':
+    root.after(100, apply_window_icon)
+
+# one PortAudio session for the whole run, initializing it re-probes every host API and device
+pa = pyaudio.PyAudio()
+
+# the device list only feeds the GUI input selector, headless mode opens audio_dev_index directly
+if root != '':
+    try:
+        # list of the names of the audio input and output devices
+        input_devices = []
+        input_device_indices = {}
+
+        # FIND THE AUDIO DEVICES ON THE SYSTEM
+        info = pa.get_host_api_info_by_index(0)
+        numdevices = info.get('deviceCount')
+
+        # find index of pyaudio input and output devices
+        for i in range(0, numdevices):
+            # each device info lookup is a round trip into PortAudio, query it once per device
+            dev_info = pa.get_device_info_by_host_api_device_index(0, i)
+            if dev_info.get('maxInputChannels') > 0:
+                input_devices.append(dev_info.get('name'))
+                input_device_indices[dev_info.get('name')] = i
+        inv_input_device_indices = dict((v, k) for k, v in input_device_indices.items())
+    except:
+        # exc_type, exc_value, exc_traceback = sys.exc_info()
+        # traceback.print_exception(exc_type, exc_value, exc_traceback,limit=2,file=sys.stdout)
+        logging.exception('Got exception on main handler')
 
 if root != '':
     record_threshold = IntVar()
@@ -247,16 +259,68 @@ if root != '':
     barvar.set(10)
     input_device.set(inv_input_device_indices.get(audio_dev_index, input_devices[0]))
 
+# plain Python copy of the window's settings, kept current by write traces that run on the Tk thread, so
+# the VOX loop and the upload workers read a dict instead of calling into Tcl from their own threads
+live_vars = {}
+live_values = {}
+
+
+def refresh_live(name, index, op):
+    try:
+        live_values[name] = live_vars[name].get()
+    except TclError:
+        # keep the last good value while an entry holds something that doesn't parse
+        pass
+
+
+def live(var):
+    return live_values[str(var)]
+
+
+if root != '':
+    for var in (record_threshold, in_channel, saveaudio, RadioFreq, BCFY_APIkey, BCFY_SystemId, BCFY_SlotId,
+                RDIO_APIurl, RDIO_APIkey, RDIO_system, RDIO_tg, OpenMHz_APIkey, OpenMHz_ShortName, OpenMHz_tgid,
+                icad_URL, icad_APIKey, icad_short_name, icad_tgid):
+        live_vars[str(var)] = var
+        live_values[str(var)] = var.get()
+        var.trace_add('write', refresh_live)
+
 RATE = 22050
 chunk = 2205
 FORMAT = pyaudio.paInt16
+SAMPWIDTH = pyaudio.get_sample_size(FORMAT)
+# one recording buffer reused for every transmission, sized for a timed out capture of the selected channel
+record_buffer = bytearray((int(timeout_time_sec / rectime) + 2) * int(RATE / chunk * rectime) * chunk * SAMPWIDTH)
+record_samples = frombuffer(record_buffer, dtype=short)
+# 100 - log10(p / 32768) * 10 / -25 * 100 folded into UI_SLOPE * log10(p) + UI_BIAS
+UI_SLOPE = 10 / 25. * 100
+UI_BIAS = 100 - UI_SLOPE * math.log10(32768.)
+
+
+# blocks captured by the PortAudio callback, waiting for the VOX loop
+audio_blocks = queue.SimpleQueue()
+# latest peak for the level bar and latest (text, colour) for the status label, overwritten by the
+# VOX loop and drained by the GUI thread
+bar_slot = [None]
+# whether the window is on screen, while it's minimized there is nothing to draw
+window_mapped = [start_minimized != 1]
+status_slot = [("Waiting For Audio", 'blue')]
+
+
+def audio_callback(in_data, frame_count, time_info, status):
+    # runs on the PortAudio thread: only hand the block over, so capture keeps going while the
+    # VOX loop is busy writing or encoding a recording
+    audio_blocks.put(in_data)
+    return (None, pyaudio.paContinue)
+
+
+# channel count the input stream was actually opened with, the dropdown can change without reopening it
+stream_channels = 1
 
 
 def start_audio_stream():
-    global pr
-    global recordstream
+    global recordstream, stream_channels
     try:
-        pr = pyaudio.PyAudio()
         CHANNELS = 1
         if root != '':
             if in_channel.get() == 'left' or in_channel.get() == 'right':
@@ -268,7 +332,9 @@ def start_audio_stream():
             index = input_device_indices[input_device.get()]
         else:
             index = audio_dev_index
-        recordstream = pr.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, output=True, frames_per_buffer=chunk, input_device_index=index)
+        recordstream = pa.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=chunk,
+                               input_device_index=index, stream_callback=audio_callback)
+        stream_channels = CHANNELS
     except:
         # exc_type, exc_value, exc_traceback = sys.exc_info()
         # traceback.print_exception(exc_type, exc_value, exc_traceback,limit=2,file=sys.stdout)
@@ -280,42 +346,249 @@ start_audio_stream()
 
 def change_audio_input(junk):
     recordstream.close()
-    pr.terminate()
+    # drop anything still queued from the previous device
+    try:
+        while 1:
+            audio_blocks.get_nowait()
+    except queue.Empty:
+        pass
     start_audio_stream()
 
 
-def record(seconds, channel='mono'):
-    alldata = bytearray()
-    for i in range(0, int(RATE / chunk * seconds)):
-        data = recordstream.read(chunk)
-        alldata.extend(data)
-    data = frombuffer(alldata, dtype=short)
+def read_blocks(blocks):
+    if blocks == 1:
+        # the usual rectime case, hand back the captured buffer as-is instead of copying it
+        return audio_blocks.get()
+    return b''.join([audio_blocks.get() for i in range(0, blocks)])
+
+
+peak_kernel = None
+if njit is not None:
+    try:
+        @njit(cache=True)
+        def peak_kernel(data):
+            # one pass over the (possibly strided) samples with no temporaries
+            m = 0
+            for i in range(data.shape[0]):
+                v = abs(int32(data[i]))
+                if v > m:
+                    m = v
+            return m
+
+        # compile now (contiguous and strided layouts) rather than on the first audio ticks
+        warm = frombuffer(bytes(8), dtype=short)
+        peak_kernel(warm)
+        peak_kernel(warm[::2])
+    except Exception:
+        # frozen builds, a read-only cache dir or a numba/numpy mismatch, the numpy scan still works
+        logger.warning("numba peak kernel unavailable, using numpy", exc_info=True)
+        peak_kernel = None
+
+
+def peak(data):
+    # single C-level scan instead of iterating the samples in Python
+    if data.size == 0:
+        return 0
+    if peak_kernel is not None:
+        return int(peak_kernel(data))
+    # max and min are plain reductions, no abs() temporary; in Python ints -32768 negates cleanly
+    return max(int(data.max()), -int(data.min()))
+
+
+def block_peak(raw, channel='mono'):
+    # frombuffer and the channel slices are views, the only pass over the samples is the peak scan
+    data = frombuffer(raw, dtype=short)
     if channel == 'left':
         data = data[0::2]
     elif channel == 'right':
         data = data[1::2]
-    else:
-        data = data
-    return data
+    return peak(data)
+
+
+def level_ui_value(p):
+    # audio level on the 0-100 squelch scale, min of scale is -25 dB
+    return UI_SLOPE * math.log10(max(p, 1)) + UI_BIAS
+
+
+def peak_threshold(threshold):
+    # raw peak at which level_ui_value() crosses the squelch threshold, lets the squelch checks
+    # compare peaks directly instead of taking a log of every chunk
+    return 10 ** ((threshold - UI_BIAS) / UI_SLOPE)
+
+
+def squelch_peaks(threshold):
+    # raw peaks a chunk has to go above to start a recording and below to count as quiet, worked out once
+    # per slider value so the VOX loop does two plain compares; 0 records everything and never goes quiet
+    if threshold == 0:
+        return -1, 0
+    open_peak = peak_threshold(threshold)
+    return open_peak, open_peak * squelch_release_ratio
+
+
+# bar graph display value for every possible peak (0-32768) on the log scale, worked out once with numpy
+# so poll_ui() does a list index instead of a log10 per update; a zero peak shows as 1
+if root != '':
+    BAR_TABLE = maximum(100 - trunc(100 - (UI_SLOPE * log10(maximum(arange(32769), 1)) + UI_BIAS)), 3)
+    BAR_TABLE = BAR_TABLE.astype(int).tolist()
+    BAR_TABLE[0] = 1
+
+
+def poll_ui(last_peak=None, last_bar=None, last_status=None):
+    # runs on the Tk thread at ~30 Hz and draws only the newest peak and status, however often the VOX
+    # loop published them; the slots are never cleared here so a value set mid-poll can't be lost
+    if not window_mapped[0]:
+        # check back less often and catch up on the latest values once the window is shown again
+        root.after(250, poll_ui, last_peak, last_bar, last_status)
+        return
+    p = bar_slot[0]
+    if p != last_peak:
+        bar = BAR_TABLE[p]
+        # neighbouring peaks mostly land on the same integer bar step, only a new step goes to Tk
+        if bar != last_bar:
+            barvar.set(bar)
+            last_bar = bar
+    status = status_slot[0]
+    if status != last_status:
+        # text and colour are applied separately, a configure only goes to Tk when its value changed
+        if last_status is None or status[0] != last_status[0]:
+            statvar.set(status[0])
+        if last_status is None or status[1] != last_status[1]:
+            StatLabel.config(fg=status[1])
+    root.after(33, poll_ui, p, last_bar, status)
+
+
+def track_window(event, mapped):
+    # <Map>/<Unmap> bound on the root also fire for every child widget, only the toplevel itself counts
+    if event.widget is root:
+        window_mapped[0] = mapped
+
+
+# with pin_cpu the VOX loop gets the first usable core and everything else shares the rest
+vox_cpus = worker_cpus = None
+if pin_cpu and hasattr(os, 'sched_setaffinity'):
+    usable_cpus = sorted(os.sched_getaffinity(0))
+    if len(usable_cpus) > 1:
+        vox_cpus = {usable_cpus[0]}
+        worker_cpus = set(usable_cpus[1:])
+
+
+def pin_cpus(cpus):
+    # pins the calling thread, affinity is per thread on Linux and ffmpeg inherits the encode worker's
+    if cpus is not None:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            logger.debug("Could not set CPU affinity", exc_info=True)
+
+
+# long-lived workers for the heartbeat and upload fan-out instead of new threads per recording
+upload_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix='voxcall-upload',
+                                                    initializer=pin_cpus, initargs=(worker_cpus,))
+# keep ffmpeg from flashing a console window on Windows, the flag doesn't exist anywhere else
+FFMPEG_FLAGS = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+# ffmpeg runs one recording at a time here, off the VOX thread
+encode_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='voxcall-encode',
+                                                    initializer=pin_cpus, initargs=(worker_cpus,))
+# cleanup waits on upload futures, so it gets its own worker rather than tying up an upload slot
+cleanup_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='voxcall-cleanup',
+                                                     initializer=pin_cpus, initargs=(worker_cpus,))
+
+
+# set at exit: the VOX loop stops handing off recordings and cleanup stops waiting on uploads
+stop_event = threading.Event()
+# futures handed to the pools and not finished yet, cancelled at exit (shutdown() only grew
+# cancel_futures in Python 3.9, Buster ships 3.7)
+pending_futures = set()
+pending_futures_lock = threading.Lock()
+
+
+def shutdown_workers():
+    # the pool threads are joined when the interpreter exits, so drop everything still queued instead of
+    # encoding and uploading it with no window left; jobs already running finish on their own timeouts
+    stop_event.set()
+    with pending_futures_lock:
+        queued = list(pending_futures)
+    for future in queued:
+        future.cancel()
+    for pool in (encode_pool, cleanup_pool, upload_pool):
+        pool.shutdown(wait=False)
+
+
+def log_failure(future):
+    with pending_futures_lock:
+        pending_futures.discard(future)
+    # pool workers swallow exceptions, make sure they still end up in log.txt
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background task failed", exc_info=future.exception())
+
+
+def submit(pool, fn, *args):
+    try:
+        future = pool.submit(fn, *args)
+    except RuntimeError:
+        # the pools are shut down at exit, a hand-off racing with that is dropped
+        logger.debug("Not starting %s, shutting down", fn.__name__)
+        return None
+    with pending_futures_lock:
+        pending_futures.add(future)
+    future.add_done_callback(log_failure)
+    return future
+
+
+# one PoolManager shared by every upload and heartbeat so keep-alive connections (and their TLS
+# sessions) to each API are reused, created on first use
+shared_http = None
+# longest Retry-After the upload retries will honour, in seconds
+retry_after_max_sec = 10
+shared_http_lock = threading.Lock()
+
+
+def http_pool_manager():
+    global shared_http
+    with shared_http_lock:
+        if shared_http is None:
+            # urllib3 is only needed once there is something to upload, keep it off the startup path
+            import urllib3
+
+            class CappedRetry(urllib3.Retry):
+                # a server asking for a long Retry-After would otherwise hold an upload worker well past
+                # cleanup_audio_files() giving up on it
+                def get_retry_after(self, response):
+                    retry_after = super().get_retry_after(response)
+                    if retry_after is not None:
+                        retry_after = min(retry_after, retry_after_max_sec)
+                    return retry_after
+
+            pool_kw = {}
+            if int(urllib3.__version__.split('.')[0]) >= 2:
+                # urllib3 2 sends request bodies in 16 KiB writes, the audio files go out in bigger ones
+                pool_kw['blocksize'] = 128 * 1024
+            # ride out brief outages and rate limiting instead of dropping the call: only failed connects
+            # and 429/503, which mean the request wasn't processed, are retried; read errors, 500, 502
+            # and 504 are not since the server may still store the upload and a retry would post the
+            # call twice; the final status still reaches the callers' own checks
+            pool_kw['retries'] = CappedRetry(total=3, read=0, backoff_factor=0.5, status_forcelist=(429, 503),
+                                             allowed_methods=frozenset(['POST', 'PUT']),
+                                             respect_retry_after_header=True, raise_on_status=False)
+            # one connection per upload worker to a host is enough, the pool never has to block
+            shared_http = urllib3.PoolManager(num_pools=8, maxsize=8, **pool_kw)
+        return shared_http
 
 
 def heartbeat():
-    if (root != '' and BCFY_APIkey.get() != '') or (root == '' and BCFY_APIkey_config != ''):
-        if version.endswith('DEV'):
-            url = 'https://api.broadcastify.com/call-upload-dev'
-        else:
-            url = 'https://api.broadcastify.com/call-upload'
-        http = urllib3.PoolManager()
+    if (root != '' and live(BCFY_APIkey) != '') or (root == '' and BCFY_APIkey_config != ''):
+        http = http_pool_manager()
         if root != '':
-            apiKey = BCFY_APIkey.get()
-            systemId = BCFY_SystemId.get()
+            apiKey = live(BCFY_APIkey)
+            systemId = live(BCFY_SystemId)
         else:
             apiKey = BCFY_APIkey_config
             systemId = BCFY_SystemId_config
         r = http.request(
             'POST',
-            url,
-            fields={'apiKey': apiKey, 'systemId': systemId, 'test': '1'})
+            BCFY_URL,
+            fields={'apiKey': apiKey, 'systemId': systemId, 'test': '1'},
+            timeout=http_timeout)
         if r.status != 200:
             logger.debug("heartbeat failed with status " + str(r.status))
             logger.debug(r.data)
@@ -323,43 +596,70 @@ def heartbeat():
             logger.debug("heartbeat OK at " + str(time.time()))
 
 
+def schedule_heartbeat():
+    # ping the API every heartbeat_interval_sec (10 minutes by default) so it knows we're alive, on a
+    # timer instead of checking from the VOX loop
+    if stop_event.is_set():
+        return
+    submit(upload_pool, heartbeat)
+    timer = threading.Timer(heartbeat_interval_sec, schedule_heartbeat)
+    timer.daemon = True
+    timer.start()
+
+
+def read_file(fname):
+    # the handle is closed even when the read fails, upload workers run for the life of the process
+    with open(fname, 'rb') as f:
+        return f.read()
+
+
+def post_form(url, fields, service):
+    # multipart POST over the shared pool, urllib3 encodes the fields and the audio into one body per call
+    r = http_pool_manager().request('POST', url, fields=fields, timeout=http_timeout)
+    if r.status != 200:
+        logger.debug("initial connect failed with status " + str(r.status))
+        logger.debug(r.data)
+    else:
+        logger.debug("upload to %s OK", service)
+    return r
+
+
+@functools.lru_cache(maxsize=4)
+def iso_timestamp(sec):
+    # ISO 8601 UTC time for rdio-scanner, at one second resolution calls finishing together share the string
+    return datetime.datetime.fromtimestamp(sec, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
+
+
 def upload_rdio(fname):
     if root != '':
-        url = RDIO_APIurl.get()
-        key = RDIO_APIkey.get()
-        system = RDIO_system.get()
-        tg = RDIO_tg.get()
+        url = live(RDIO_APIurl)
+        key = live(RDIO_APIkey)
+        system = live(RDIO_system)
+        tg = live(RDIO_tg)
     else:
         url = RDIO_APIurl_config
         key = RDIO_APIkey_config
         system = RDIO_system_config
         tg = RDIO_tg_config
     if url != '' and key != '' and system != '' and tg != '':
-        http = urllib3.PoolManager()
-        f = open(fname, 'rb')
-        audio_data = f.read()
-        f.close()
-        r = http.request(
-            'POST',
-            url,
-            fields={'key': key, 'dateTime': datetime.datetime.utcnow().isoformat() + 'Z', 'system': str(system),
-                    'talkgroup': str(tg), 'audio': (fname, audio_data, 'application/octet-stream')},
-            timeout=30)
-        if r.status != 200:
-            logger.debug("initial connect failed with status " + str(r.status))
-            logger.debug(r.data)
-        else:
-            logger.debug("upload to rdio-scanner OK")
+        audio_data = read_file(fname)
+        post_form(url, {'key': key, 'dateTime': iso_timestamp(int(time.time())), 'system': str(system),
+                        'talkgroup': str(tg), 'audio': (fname, audio_data, 'application/octet-stream')},
+                  'rdio-scanner')
     else:
         logger.info("No rdio-scanner config detected, skipping upload to rdio-scanner API")
 
 
+# form fields that are the same for every OpenMHz upload, voxcall has no error/spike counts or unit ids
+OPENMHZ_STATIC_FIELDS = {'error_count': '0', 'spike_count': '0', 'emergency': '0', 'source_list': '[]'}
+
+
 def upload_openmhz(fname, start_time, duration):
     if root != '':
-        api_key = OpenMHz_APIkey.get()
-        short_name = OpenMHz_ShortName.get()
-        freq = float(RadioFreq.get()) * 1e6
-        tgid = OpenMHz_tgid.get()
+        api_key = live(OpenMHz_APIkey)
+        short_name = live(OpenMHz_ShortName)
+        freq = float(live(RadioFreq)) * 1e6
+        tgid = live(OpenMHz_tgid)
     else:
         api_key = OpenMHz_APIkey_config
         short_name = OpenMHz_ShortName_config
@@ -370,42 +670,24 @@ def upload_openmhz(fname, start_time, duration):
         logger.error("OpenMHz API Key, tgid, freq, or Short Name not found.")
         return False
 
-    source_list = []
-
-    http = urllib3.PoolManager()
     url = f"https://api.openmhz.com/{short_name}/upload"
-    f = open(fname, 'rb')
-    audio_data = f.read()
-    f.close()
-    r = http.request(
-        'POST',
-        url,
-        fields={
-            'call': (os.path.basename(fname), audio_data, 'application/octet-stream'),
-            'freq': str(freq),
-            'error_count': str(0),
-            'spike_count': str(0),
-            'start_time': str(start_time),
-            'stop_time': str(start_time + duration),
-            'call_length': str(duration),
-            'talkgroup_num': str(tgid),
-            'emergency': str(0),
-            'api_key': api_key,
-            'source_list': json.dumps(source_list)
-        },
-        timeout=30)
-    if r.status != 200:
-        logger.debug("initial connect failed with status " + str(r.status))
-        logger.debug(r.data)
-    else:
-        logger.debug("upload to OpenMHz OK")
+    audio_data = read_file(fname)
+    post_form(url, dict(OPENMHZ_STATIC_FIELDS, **{
+        'call': (os.path.basename(fname), audio_data, 'application/octet-stream'),
+        'freq': str(freq),
+        'start_time': str(start_time),
+        'stop_time': str(start_time + duration),
+        'call_length': str(duration),
+        'talkgroup_num': str(tgid),
+        'api_key': api_key
+    }), 'OpenMHz')
 
     return True
 
 def create_icad_json(json_fname, start_time, duration):
     if root != '':
-        short_name = icad_short_name.get()
-        tgid = icad_tgid.get()
+        short_name = live(icad_short_name)
+        tgid = live(icad_tgid)
     else:
         short_name = icad_short_name_config
         tgid = icad_tgid_config
@@ -441,8 +723,8 @@ def upload_icad_ttd(fname, start_time, duration):
         return False
 
     if root != '':
-        api_key = icad_APIKey.get()
-        url = icad_URL.get()
+        api_key = live(icad_APIKey)
+        url = live(icad_URL)
     else:
         api_key = icad_APIkey_config
         url = icad_URL_config
@@ -451,268 +733,331 @@ def upload_icad_ttd(fname, start_time, duration):
         logger.error("iCAD API Key, or URL not found.")
         return False
 
-    json_data = open(json_fname, 'rb').read()
-
-    http = urllib3.PoolManager()
-    f = open(fname, 'rb')
-    audio_data = f.read()
-    f.close()
-    r = http.request(
-        'POST',
-        url,
-        fields={
-            'audioFile': (os.path.basename(fname), audio_data, 'application/octet-stream'),
-            'jsonFile': (os.path.basename(json_fname), json_data, 'application/json')
-        },
-        timeout=30)
-    if r.status != 200:
-        logger.debug("initial connect failed with status " + str(r.status))
-        logger.debug(r.data)
-    else:
-        logger.debug("upload to iCAD Tone Detection OK")
+    json_data = read_file(json_fname)
+
+    audio_data = read_file(fname)
+    post_form(url, {
+        'audioFile': (os.path.basename(fname), audio_data, 'application/octet-stream'),
+        'jsonFile': (os.path.basename(json_fname), json_data, 'application/json')
+    }, 'iCAD Tone Detection')
 
     return True
 
 
 def upload(fname, duration):
-    if (root != '' and BCFY_APIkey.get() != '') or (root == '' and BCFY_APIkey_config != ''):
-        if version.endswith('DEV'):
-            url = 'https://api.broadcastify.com/call-upload-dev'
-        else:
-            url = 'https://api.broadcastify.com/call-upload'
-        http = urllib3.PoolManager()
+    if (root != '' and live(BCFY_APIkey) != '') or (root == '' and BCFY_APIkey_config != ''):
+        http = http_pool_manager()
         if root != '':
             r = http.request(
                 'POST',
-                url,
-                fields={'apiKey': BCFY_APIkey.get(), 'systemId': BCFY_SystemId.get(), 'callDuration': str(duration),
-                        'ts': fname.split('-')[0], 'tg': BCFY_SlotId.get(), 'src': '0', 'freq': RadioFreq.get(),
-                        'enc': 'mp3'})
+                BCFY_URL,
+                fields={'apiKey': live(BCFY_APIkey), 'systemId': live(BCFY_SystemId), 'callDuration': str(duration),
+                        'ts': fname.split('-')[0], 'tg': live(BCFY_SlotId), 'src': '0', 'freq': live(RadioFreq),
+                        'enc': 'mp3'},
+                timeout=http_timeout)
         else:
             r = http.request(
                 'POST',
-                url,
+                BCFY_URL,
                 fields={'apiKey': BCFY_APIkey_config, 'systemId': BCFY_SystemId_config, 'callDuration': str(duration),
                         'ts': fname.split('-')[0], 'tg': BCFY_SlotId_config, 'src': '0', 'freq': RadioFreq_config,
-                        'enc': 'mp3'})
+                        'enc': 'mp3'},
+                timeout=http_timeout)
 
         if r.status != 200:
             logger.debug("initial connect failed with status " + str(r.status))
             logger.debug(r.data)
         else:
-            resp = r.data.decode('utf-8').split(' ')
+            # decoded once, the error branch below logs the same text
+            body = r.data.decode('utf-8')
+            resp = body.split(' ')
             if resp[0] == '0':
                 upload_url = resp[1]
-                file_data = open(fname, "rb").read()
+                file_data = read_file(fname)
                 r1 = http.request(
                     'PUT',
                     upload_url,
                     fields={
                         'filefield': (fname, file_data, 'audio/mpeg'),
-                    })
+                    },
+                    timeout=http_timeout)
                 if r1.status == 200:
                     logger.debug("upload to BCFY OK")
                 else:
                     logger.debug("upload failed with status " + str(r1.status))
                     logger.debug(r1.data)
             else:
-                logger.debug("error response from server: " + r.data.decode('utf-8'))
+                logger.debug("error response from server: " + body)
     else:
         logger.info("No BCFY config found, not attempting to upload there")
 
 
-def cleanup_audio_files(fname):
+def encode_targets():
+    # which formats anything is going to consume: OpenMHz takes the M4A, everything else the MP3
+    if root != '':
+        want_mp3 = (live(BCFY_APIkey) != '' or live(RDIO_APIurl) != '' or live(icad_URL) != ''
+                    or live(saveaudio) != 0)
+        want_m4a = live(OpenMHz_APIkey) != ''
+    else:
+        want_mp3 = (BCFY_APIkey_config != '' or RDIO_APIurl_config != '' or icad_URL_config != ''
+                    or saveaudio_config != 0)
+        want_m4a = OpenMHz_APIkey_config != ''
+    return want_mp3, want_m4a
+
+
+def cleanup_audio_files(fname, uploads=()):
     if root != '':
-        saveit = saveaudio.get()
+        saveit = live(saveaudio)
     else:
         saveit = saveaudio_config
+    mp3_fname = fname.replace('.wav', '.mp3')
+    # wait for the uploads to be done with the files before moving or deleting them
+    # in short steps so an exit doesn't sit out the whole wait
+    pending = set(uploads)
+    deadline = time.monotonic() + upload_wait_time_sec
+    while pending and not stop_event.is_set() and time.monotonic() < deadline:
+        done, pending = concurrent.futures.wait(pending, timeout=min(0.5, max(deadline - time.monotonic(), 0)))
+    if pending and not stop_event.is_set():
+        logger.warning("%d upload(s) of %s still running after %s sec, cleaning up anyway",
+                       len(pending), fname, upload_wait_time_sec)
+    remove_fnames = [fname.replace('.wav', '.m4a')]
     if saveit != 0:
+        os.makedirs('./audiosave', exist_ok=True)
+        logger.debug("Moving mp3 file for archiving")
         try:
-            os.makedirs('./audiosave')
+            # the temp mp3 is going away anyway, a rename on the same filesystem avoids copying the data
+            os.replace(mp3_fname, './audiosave/' + mp3_fname)
+        except FileNotFoundError:
+            logger.debug("mp3 not present, nothing to archive: " + mp3_fname)
         except OSError as e:
-            if e.errno != errno.EEXIST:
+            if e.errno != errno.EXDEV:
                 raise
-        logger.debug("Moving mp3 file for archiving")
-        copyfile(fname.replace('.wav', '.mp3'), './audiosave/' + fname.replace('.wav', '.mp3'))
-    time.sleep(
-        10)  # this is hacky - wait to make sure the upload threads have had time to grab the file before deleting it
+            copyfile(mp3_fname, './audiosave/' + mp3_fname)
+            remove_fnames.append(mp3_fname)
+    else:
+        remove_fnames.append(mp3_fname)
     logger.debug("Removing temporary audio files")
-    os.remove(fname.replace('.wav', '.mp3'))
-    os.remove(fname.replace('.wav', '.m4a'))
+    for remove_fname in remove_fnames:
+        try:
+            os.remove(remove_fname)
+        except FileNotFoundError:
+            pass
+
+
+def encode_and_upload(fname, data, start_time, duration):
+    try:
+        want_mp3, want_m4a = encode_targets()
+        outputs = []
+        if want_mp3:
+            outputs += ["-b:a", str(mp3_bitrate), "-ar", "22050", fname.replace('.wav', '.mp3')]
+        if want_m4a:
+            outputs += ["-b:a", str(mp3_bitrate), "-ar", "22050", fname.replace('.wav', '.m4a')]
+        if outputs:
+            # one ffmpeg process reads the raw samples from stdin once and writes every output
+            subprocess.run(["ffmpeg", "-y", "-f", "s16le", "-ar", str(RATE), "-ac", "1", "-i", "pipe:0"] + outputs,
+                           input=data, creationflags=FFMPEG_FLAGS)
+            logger.debug("done converting")
+        else:
+            logger.info("No upload or archive configured, skipping audio encode")
+    except:
+        # exc_type, exc_value, exc_traceback = sys.exc_info()
+        # traceback.print_exception(exc_type, exc_value, exc_traceback,limit=2,file=sys.stdout)
+        logging.exception('Got exception on main handler')
+    uploads = [submit(upload_pool, upload, fname.replace('.wav', '.mp3'), duration),
+               submit(upload_pool, upload_rdio, fname.replace('.wav', '.mp3')),
+               submit(upload_pool, upload_openmhz, fname.replace('.wav', '.m4a'), start_time, duration),
+               submit(upload_pool, upload_icad_ttd, fname.replace('.wav', '.mp3'), start_time, duration)]
+    uploads = [future for future in uploads if future is not None]
+    if submit(cleanup_pool, cleanup_audio_files, fname, uploads) is None:
+        # shutting down, still don't leave the encoded files behind
+        cleanup_audio_files(fname, uploads)
 
 
 def start():
     global rec_debounce_counter
-    last_API_attempt = 0
+    pin_cpus(vox_cpus)
+    schedule_heartbeat()
     # wait for audio to be present
     counter = 0
-    while 1:
-        if time.time() - last_API_attempt > 10 * 60:
-            _thread.start_new_thread(heartbeat, ())  # ping the API every 10 minutes so it knows we're alive
-            last_API_attempt = time.time()
+    last_threshold = None
+    # headless mode compares raw peaks against the configured threshold, the window's slider is converted
+    # by squelch_peaks() whenever it moves
+    open_peak = record_threshold_config
+    release_peak = record_threshold_config * squelch_release_ratio
+    # loop invariants, looked up once instead of on every chunk
+    gui = root != ''
+    blocks_per_tick = int(RATE / chunk * rectime)
+    silence_ticks = vox_silence_time * (1 / rectime)
+    timeout_ticks = timeout_time_sec * (1 / rectime)
+    while not stop_event.is_set():
         # get 100 ms of audio
-        if root != '':
-            chan = in_channel.get()
+        if gui:
+            chan = live(in_channel)
         else:
             chan = in_channel_config
-        audio_data = record(rectime, chan)
-        if max(abs(audio_data)) == 0 and root != '':
-            barvar.set(1)
-        elif counter >= 6 and root != '':
-            # set the bar graph display based on the current audio peak using a log scale
-            barvar.set(max(100 - int(log10(max(max(abs(audio_data)), 1.0) / 32768.) * 10 / -25. * 100),
-                           3))  # min of scale is -25 dB
+        audio_peak = block_peak(read_blocks(blocks_per_tick), chan)
+        if audio_peak == 0 and gui:
+            bar_slot[0] = 0
+        elif counter >= 6 and gui:
+            bar_slot[0] = audio_peak
             counter = 0
         counter = counter + 1
-        if root != '':
-            if 100 - log10(max(max(abs(audio_data)),
-                               1.0) / 32768.) * 10 / -25. * 100 > record_threshold.get() or record_threshold.get() == 0:
-                rec_debounce_counter = rec_debounce_counter + 1
-                logger.debug('Level: ' + str(
-                    100 - log10(max(max(abs(audio_data)), 1.0) / 32768.) * 10 / -25. * 100) + " Threshold: " + str(
-                    record_threshold.get()))
-            else:
-                rec_debounce_counter = 0
+        if gui:
+            threshold = live(record_threshold)
+            if threshold != last_threshold:
+                last_threshold = threshold
+                open_peak, release_peak = squelch_peaks(threshold)
+        if audio_peak > open_peak:
+            rec_debounce_counter = rec_debounce_counter + 1
+            if logger.isEnabledFor(logging.DEBUG):
+                if gui:
+                    logger.debug('Level: %s Threshold: %s', level_ui_value(audio_peak), threshold)
+                else:
+                    logger.debug('Level: %s Threshold: %s', audio_peak, record_threshold_config)
         else:
-            if max(abs(audio_data)) > record_threshold_config:
-                rec_debounce_counter = rec_debounce_counter + 1
-                logger.debug('Level: ' + str(max(abs(audio_data))) + " Threshold: " + str(record_threshold_config))
-            else:
-                rec_debounce_counter = 0
+            rec_debounce_counter = 0
         if rec_debounce_counter >= 2:
             rec_debounce_counter = 0
             logger.debug("threshold exceeded")
             start_time = time.time()
             quiet_samples = 0
             total_samples = 0
-            alldata = bytearray()
-            logger.debug("Waiting for Silence " + time.strftime('%H:%M:%S on %m/%d/%y'))
-            if root != '':
-                statvar.set("Recording")
-                StatLabel.config(fg='green')
+            # the selected channel is picked out chunk by chunk, so the buffer always holds mono PCM; the stride
+            # follows the open stream, a stereo stream with mono selected records the left channel
+            stride = stream_channels
+            if chan == 'right' and stride == 2:
+                offset = 1
+            else:
+                offset = 0
+            pos = 0
+            logger.debug("Waiting for Silence")
+            if gui:
+                status_slot[0] = ("Recording", 'green')
             timed_out = 0
-            while (quiet_samples < (vox_silence_time * (1 / rectime))):
-                if (total_samples > (timeout_time_sec * (1 / rectime))):
-                    if root != '':
-                        statvar.set("RECORDING TIMED OUT")
-                        StatLabel.config(fg='red')
+            while quiet_samples < silence_ticks and not stop_event.is_set():
+                if total_samples > timeout_ticks:
+                    if gui:
+                        status_slot[0] = ("RECORDING TIMED OUT", 'red')
                     else:
                         logger.debug("RECORDING TIMED OUT")
                     timed_out = 1
-                temp = bytearray()
-                for i in range(0, int(RATE / chunk * rectime)):
-                    data = recordstream.read(chunk)
-                    temp.extend(data)
+                samples = frombuffer(read_blocks(blocks_per_tick), dtype=short)[offset::stride]
                 if timed_out == 0:
-                    alldata.extend(temp)
-                audio_data = frombuffer(temp, dtype=short)
-                if root != '':
-                    if max(abs(audio_data)) == 0:
-                        barvar.set(1)
-                    else:
-                        # set the bar graph display based on the current audio peak using a log scale
-                        barvar.set(max(100 - int(log10(max(max(abs(audio_data)), 1.0) / 32768.) * 10 / -25. * 100),
-                                       3))  # min of scale is -25 dB
-                if root != '':
-                    if 100 - log10(max(max(abs(audio_data)),
-                                       1.0) / 32768.) * 10 / -25. * 100 < record_threshold.get() and record_threshold.get() != 0:
-                        quiet_samples = quiet_samples + 1
-                    else:
-                        quiet_samples = 0
+                    # never past the end of the buffer, e.g. the device is switched mid-recording
+                    n = min(samples.size, record_samples.size - pos)
+                    record_samples[pos:pos + n] = samples[:n]
+                    pos = pos + n
+                audio_peak = peak(samples)
+                if gui:
+                    bar_slot[0] = audio_peak
+                if gui:
+                    threshold = live(record_threshold)
+                    if threshold != last_threshold:
+                        last_threshold = threshold
+                        open_peak, release_peak = squelch_peaks(threshold)
+                if audio_peak < release_peak:
+                    quiet_samples = quiet_samples + 1
                 else:
-                    if max(abs(audio_data)) < record_threshold_config:
-                        quiet_samples = quiet_samples + 1
-                    else:
-                        quiet_samples = 0
+                    quiet_samples = 0
                 total_samples = total_samples + 1
-            logger.debug("Done recording " + time.strftime('%H:%M:%S on %m/%d/%y'))
+            logger.debug("Done recording")
+            if stop_event.is_set():
+                break
+            data = memoryview(record_buffer)[:pos * SAMPWIDTH]
             if int(vox_silence_time * -(1 / rectime)) > 0:
-                alldata = alldata[:int(vox_silence_time * -round(1 / rectime))]
-            data = frombuffer(alldata, dtype=short)  # convert from string to list to separate channels
-            if chan == 'left':
-                data = data[0::2]
-            elif chan == 'right':
-                data = data[1::2]
+                data = data[:int(vox_silence_time * -round(1 / rectime))]
+            duration = pos / float(RATE)
+            # the .wav name is only the base for the encoded files, the PCM is piped straight to ffmpeg
+            if gui:
+                slot_id = live(BCFY_SlotId)
             else:
-                data = data
-            duration = len(data) / float(RATE)
-            # convert back to binary to write to WAV later
-            # data = chararray.tostring(array(data))
-            data = chararray.tobytes(array(data))
-            # write data to WAVE file
-            fname = str(round(time.time())) + "-" + str(BCFY_SlotId.get()) + ".wav"
-            WAVE_OUTPUT_FILENAME = fname
-
-            wf = wave.open(WAVE_OUTPUT_FILENAME, 'wb')
-            wf.setnchannels(1)
-            wf.setsampwidth(pyaudio.PyAudio().get_sample_size(FORMAT))
-            wf.setframerate(RATE)
-            wf.writeframes(data)
-            wf.close()
-            logger.debug("done writing WAV " + time.strftime('%H:%M:%S on %m/%d/%y'))
-            try:
-                logger.debug(fname)
-                try:
-                    flags = subprocess.CREATE_NO_WINDOW
-                except:
-                    flags = 0
-                subprocess.call(["ffmpeg", "-y", "-i", fname, "-b:a", str(mp3_bitrate), "-ar", "22050",
-                                 fname.replace('.wav', '.mp3')], creationflags=flags)
-                logger.debug("done converting to MP3 " + time.strftime('%H:%M:%S on %m/%d/%y'))
-                subprocess.call(["ffmpeg", "-y", "-i", fname, "-b:a", str(mp3_bitrate), "-ar", "22050",
-                                 fname.replace('.wav', '.m4a')], creationflags=flags)
-                logger.debug("done converting to M4A " + time.strftime('%H:%M:%S on %m/%d/%y'))
-                os.remove(fname)
-            except:
-                # exc_type, exc_value, exc_traceback = sys.exc_info()
-                # traceback.print_exception(exc_type, exc_value, exc_traceback,limit=2,file=sys.stdout)
-                logging.exception('Got exception on main handler')
-            _thread.start_new_thread(upload, (fname.replace('.wav', '.mp3'), duration))
-            _thread.start_new_thread(upload_rdio, (fname.replace('.wav', '.mp3'),))
-            _thread.start_new_thread(upload_openmhz, (fname.replace('.wav', '.m4a'), start_time, duration))
-            _thread.start_new_thread(upload_icad_ttd, (fname.replace('.wav', '.mp3'), start_time, duration))
-            _thread.start_new_thread(cleanup_audio_files, (fname,))
-            last_API_attempt = time.time()
-            logger.debug("duration: " + str(duration) + " sec")
-            logger.debug("waiting for audio " + time.strftime('%H:%M:%S on %m/%d/%y'))
-            if root != '':
-                statvar.set("Waiting For Audio")
-                StatLabel.config(fg='blue')
+                slot_id = BCFY_SlotId_config
+            fname = str(round(time.time())) + "-" + str(slot_id) + ".wav"
+            logger.debug(fname)
+            # the encode and upload fan-out run on the encode worker so capture resumes right away, the PCM
+            # is copied out first because record_buffer is reused by the next recording
+            submit(encode_pool, encode_and_upload, fname, bytes(data), start_time, duration)
+            logger.debug("duration: %s sec", duration)
+            logger.debug("waiting for audio")
+            if gui:
+                status_slot[0] = ("Waiting For Audio", 'blue')
 
 
 def saveconfigdata():
     if root != '':
-        config = ConfigParser()
-        config.read('config.cfg')
-        if 'Section1' not in config.sections():
-            config.add_section('Section1')
-        cfgfile = open('config.cfg', 'w')
-        config.set('Section1', 'audio_dev_index', str(input_device_indices[input_device.get()]))
-        config.set('Section1', 'record_threshold', str(record_threshold.get()))
-        config.set('Section1', 'vox_silence_time', str(vox_silence_time))
-        config.set('Section1', 'in_channel', in_channel.get())
-        config.set('Section1', 'BCFY_SystemId', BCFY_SystemId.get())
-        config.set('Section1', 'RadioFreq', RadioFreq.get())
-        config.set('Section1', 'BCFY_APIkey', BCFY_APIkey.get())
-        config.set('Section1', 'BCFY_SlotId', BCFY_SlotId.get())
-        config.set('Section1', 'saveaudio', str(saveaudio.get()))
-        config.set('Section1', 'vox_silence_time', str(vox_silence_time))
-        config.set('Section1', 'RDIO_APIkey', RDIO_APIkey.get())
-        config.set('Section1', 'RDIO_APIurl', RDIO_APIurl.get())
-        config.set('Section1', 'RDIO_system', RDIO_system.get())
-        config.set('Section1', 'RDIO_tg', RDIO_tg.get())
-        config.set('Section1', 'openmhz_api_key', OpenMHz_APIkey.get())
-        config.set('Section1', 'openmhz_short_name', OpenMHz_ShortName.get())
-        config.set('Section1', 'openmhz_tgid', OpenMHz_tgid.get())
-        config.set('Section1', 'icad_api_key', icad_APIKey.get())
-        config.set('Section1', 'icad_url', icad_URL.get())
-        config.set('Section1', 'icad_tgid', icad_tgid.get())
-        config.set('Section1', 'icad_short_name', icad_short_name.get())
-        config.write(cfgfile)
-        cfgfile.close()
+        # what goes in Section1, in file order: Tk variables are read from the window, everything else
+        # is the value voxcall is running with
+        fields = (('audio_dev_index', input_device_indices[input_device.get()]),
+                  ('record_threshold', record_threshold),
+                  ('vox_silence_time', vox_silence_time),
+                  ('in_channel', in_channel),
+                  ('BCFY_SystemId', BCFY_SystemId),
+                  ('RadioFreq', RadioFreq),
+                  ('BCFY_APIkey', BCFY_APIkey),
+                  ('BCFY_SlotId', BCFY_SlotId),
+                  ('saveaudio', saveaudio),
+                  ('RDIO_APIkey', RDIO_APIkey),
+                  ('RDIO_APIurl', RDIO_APIurl),
+                  ('RDIO_system', RDIO_system),
+                  ('RDIO_tg', RDIO_tg),
+                  ('openmhz_api_key', OpenMHz_APIkey),
+                  ('openmhz_short_name', OpenMHz_ShortName),
+                  ('openmhz_tgid', OpenMHz_tgid),
+                  ('icad_api_key', icad_APIKey),
+                  ('icad_url', icad_URL),
+                  ('icad_tgid', icad_tgid),
+                  ('icad_short_name', icad_short_name),
+                  ('squelch_release_ratio', squelch_release_ratio),
+                  ('pin_cpu', pin_cpu),
+                  ('http_timeout', http_timeout),
+                  ('heartbeat_interval', heartbeat_interval_sec))
+        settings = [(key, str(value.get() if isinstance(value, Variable) else value)) for key, value in fields]
+        # the values are read from Tk here, the file work runs on a non-daemon thread so the window can
+        # close right away while the interpreter still waits for the write to finish
+        threading.Thread(target=write_config, args=(settings,), name='voxcall-save').start()
         root.destroy()
 
 
+def config_line(key, value):
+    # continuation lines of a multi-line value have to be indented or ConfigParser won't read them back
+    return '%s = %s\n' % (key, value.replace('\n', '\n\t'))
+
+
+def own_items(section):
+    # items() also returns everything inherited from [DEFAULT], keep only what the section sets itself
+    defaults = config.defaults()
+    return [(key, config.get(section, key, raw=True)) for key in config.options(section)
+            if key not in defaults or config.get(section, key, raw=True) != defaults[key]]
+
+
+def write_config(settings):
+    # reuse the config parsed at startup to carry over keys and sections voxcall doesn't manage
+    known = set(key.lower() for key, value in settings)
+    # '%' is escaped because ConfigParser interpolates values when reading them back
+    lines = ['[Section1]\n'] + [config_line(key.lower(), value.replace('%', '%%')) for key, value in settings]
+    if config.has_section('Section1'):
+        lines += [config_line(key, value) for key, value in own_items('Section1') if key not in known]
+    for section in config.sections():
+        if section != 'Section1':
+            lines.append('\n[%s]\n' % section)
+            lines += [config_line(key, value) for key, value in own_items(section)]
+    defaults = config.defaults()
+    if defaults:
+        lines = ['[%s]\n' % config.default_section] + [config_line(key, value) for key, value in defaults.items()] \
+            + ['\n'] + lines
+    text = ''.join(lines)
+    try:
+        with open('config.cfg') as cfgfile:
+            unchanged = cfgfile.read() == text
+    except OSError:
+        unchanged = False
+    # nothing was edited, leave the file (and its mtime) alone
+    if not unchanged:
+        # write to a temp file and swap it in so a failed save can't leave a truncated config
+        with open('config.cfg.tmp', 'w') as cfgfile:
+            cfgfile.write(text)
+        os.replace('config.cfg.tmp', 'config.cfg')
+
 if root != '':
     f = Frame(bd=10)
     f.grid(row=1)
@@ -804,7 +1149,16 @@ if root != '':
     Label(f, text='Audio\n Level').grid(row=25, column=8)
 
 if root != '':
-    _thread.start_new_thread(start, ())
+    # named so it shows up in log records and thread dumps, daemon because closing the window ends the app
+    threading.Thread(target=start, name='voxcall-vox', daemon=True).start()
+    root.after(33, poll_ui, None, None, status_slot[0])
+    root.bind('<Map>', lambda event: track_window(event, True))
+    root.bind('<Unmap>', lambda event: track_window(event, False))
     root.mainloop()
+    # the window is gone, stop the VOX loop before the pools so it can't hand them new work
+    shutdown_workers()
 else:
-    start()
+    try:
+        start()
+    finally:
+        shutdown_workers()